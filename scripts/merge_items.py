@@ -7,12 +7,17 @@ Merge items from MetaForge API and RaidTheory arcraiders-data repo into data/ite
 - Output: stable, sorted JSON for clean Git diffs
 """
 
-import json
+import atexit
+import hashlib
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
@@ -25,28 +30,133 @@ RAIDTHEORY_ITEMS_DIR = Path("external/arcraiders-data/items")
 
 OUTPUT_PATH = Path("data/items.json")
 
+# Last MetaForge response, revalidated with ETag / Last-Modified on each run
+METAFORGE_CACHE_DIR = Path(".cache/metaforge")
+METAFORGE_CACHE_BODY = METAFORGE_CACHE_DIR / "items.bin"
+METAFORGE_CACHE_META = METAFORGE_CACHE_DIR / "items.meta.json"
+
+# RaidTheory values that never overwrite a MetaForge field
+# (a tuple, not a set, since [] and {} are unhashable)
+EMPTY_VALUES = (None, "", [], {})
+
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (5, 30)
+
+
+# ---- HTTP -------------------------------------------------------------------
+
+# Shared session so connections (and TLS state) are reused between requests
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+SESSION.headers["Accept"] = "application/json"
+atexit.register(SESSION.close)
+
+
+# ---- Cache ------------------------------------------------------------------
+
+def read_metaforge_validators() -> Optional[Dict[str, str]]:
+    """Return the cached MetaForge ETag / Last-Modified, or None if not cached."""
+    try:
+        return orjson.loads(METAFORGE_CACHE_META.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+
+def read_metaforge_body() -> Optional[bytes]:
+    """Return the cached MetaForge response body, or None if it is missing."""
+    try:
+        return METAFORGE_CACHE_BODY.read_bytes()
+    except OSError:
+        return None
+
+
+def clear_metaforge_cache() -> None:
+    """Remove the cached MetaForge validators and body."""
+    try:
+        # Validators first, so a leftover body is never revalidated
+        METAFORGE_CACHE_META.unlink(missing_ok=True)
+        METAFORGE_CACHE_BODY.unlink(missing_ok=True)
+    except OSError as exc:
+        logging.warning("Could not clear MetaForge cache in %s: %s", METAFORGE_CACHE_DIR, exc)
+
+
+def write_metaforge_cache(resp: requests.Response, body: bytes) -> None:
+    """Store a MetaForge response body along with its ETag / Last-Modified."""
+    validators = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }
+    validators = {k: v for k, v in validators.items() if v}
+    if not validators:
+        # Nothing to revalidate against next time, and the old entry is stale
+        clear_metaforge_cache()
+        return
+
+    try:
+        METAFORGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Drop the old validators first so they never describe a newer body
+        METAFORGE_CACHE_META.unlink(missing_ok=True)
+        METAFORGE_CACHE_BODY.write_bytes(body)
+        METAFORGE_CACHE_META.write_bytes(orjson.dumps(validators))
+    except OSError as exc:
+        logging.warning("Could not write MetaForge cache to %s: %s", METAFORGE_CACHE_DIR, exc)
+
 
 # ---- Loaders ----------------------------------------------------------------
 
+def extract_item_list(data: Any, keys: Tuple[str, ...]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Return the item list from a parsed JSON document.
+
+    Accepts a bare list, or a dict holding the list under one of `keys`.
+    Returns None for any other shape.
+    """
+    if type(data) is list:
+        return data
+    if type(data) is dict:
+        for key in keys:
+            value = data.get(key)
+            if type(value) is list:
+                return value
+    return None
+
+
 def load_metaforge_items() -> List[Dict[str, Any]]:
     """Fetch items from MetaForge API."""
     logging.info("Fetching MetaForge items from %s", METAFORGE_ITEMS_URL)
-    resp = requests.get(METAFORGE_ITEMS_URL, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+
+    headers: Dict[str, str] = {}
+    validators = read_metaforge_validators()
+    if validators is not None:
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    resp = SESSION.get(METAFORGE_ITEMS_URL, timeout=HTTP_TIMEOUT, headers=headers)
+    body: Optional[bytes] = None
+    if resp.status_code == 304 and validators is not None:
+        body = read_metaforge_body()
+        if body is not None:
+            logging.info("MetaForge items not modified – using cached response")
+        else:
+            logging.warning("Cached MetaForge body missing – fetching full response")
+            clear_metaforge_cache()
+            resp = SESSION.get(METAFORGE_ITEMS_URL, timeout=HTTP_TIMEOUT)
+
+    if body is None:
+        resp.raise_for_status()
+        body = resp.content
+        write_metaforge_cache(resp, body)
+
+    data = orjson.loads(body)
 
     # TODO: depending on how their API is shaped (and paginated),
     # you may need to add pagination or params here.
-    if isinstance(data, dict):
-        for key in ("items", "data", "results"):
-            if key in data and isinstance(data[key], list):
-                items = data[key]
-                break
-        else:
+    items = extract_item_list(data, ("items", "data", "results"))
+    if items is None:
+        if isinstance(data, dict):
             raise ValueError("Unexpected MetaForge response shape (dict without items list)")
-    elif isinstance(data, list):
-        items = data
-    else:
         raise ValueError(f"Unexpected MetaForge response type: {type(data)}")
 
     logging.info("Loaded %d MetaForge items", len(items))
@@ -59,7 +169,10 @@ def load_raidtheory_items() -> List[Dict[str, Any]]:
 
     We read ALL JSON files under external/arcraiders-data/items/.
     """
-    if not RAIDTHEORY_ITEMS_DIR.exists():
+    logging.info("Scanning RaidTheory items in %s", RAIDTHEORY_ITEMS_DIR)
+    try:
+        paths = [p for p in RAIDTHEORY_ITEMS_DIR.iterdir() if p.suffix == ".json"]
+    except FileNotFoundError:
         logging.warning(
             "RaidTheory items directory %s not found – skipping RaidTheory source",
             RAIDTHEORY_ITEMS_DIR,
@@ -68,20 +181,16 @@ def load_raidtheory_items() -> List[Dict[str, Any]]:
 
     items: List[Dict[str, Any]] = []
 
-    logging.info("Scanning RaidTheory items in %s", RAIDTHEORY_ITEMS_DIR)
-    for path in RAIDTHEORY_ITEMS_DIR.glob("*.json"):
+    for path in paths:
         logging.info("  Reading %s", path)
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = orjson.loads(path.read_bytes())
 
-        if isinstance(data, list):
-            items.extend(data)
+        # Some files may be of shape { "items": [...] }
+        file_items = extract_item_list(data, ("items",))
+        if file_items is not None:
+            items.extend(file_items)
         elif isinstance(data, dict):
-            # Some files may be of shape { "items": [...] }
-            if "items" in data and isinstance(data["items"], list):
-                items.extend(data["items"])
-            else:
-                items.append(data)
+            items.append(data)
         else:
             logging.warning("    Skipping %s – unexpected JSON type %s", path, type(data))
 
@@ -98,13 +207,17 @@ def item_key(item: Dict[str, Any]) -> str:
     Priority: id → slug → name.
     Adjust if your real data uses something else.
     """
-    for field in ("id", "slug", "name"):
-        value = item.get(field)
-        if isinstance(value, (str, int)):
-            return str(value).lower().strip()
+    value = item.get("id") or item.get("slug") or item.get("name")
+    if type(value) is str:
+        return value.lower().strip()
+    if type(value) is int:
+        return str(value)
 
-    # Fallback: entire item as a JSON string (rare)
-    return json.dumps(item, sort_keys=True)
+    # Anything else (e.g. a localized name dict) is not a usable key
+
+    # Fallback: hash of the entire item as canonical JSON (rare)
+    canonical = orjson.dumps(item, option=orjson.OPT_SORT_KEYS)
+    return "h:" + hashlib.blake2b(canonical, digest_size=12).hexdigest()
 
 
 def merge_items(
@@ -118,24 +231,33 @@ def merge_items(
     - RaidTheory overlays additional/updated fields for matching items.
     - New RaidTheory-only items are added as well.
     """
-    merged: Dict[str, Dict[str, Any]] = {}
+    # Local aliases for the hot loops below
+    _key = item_key
+    _dict = dict
 
-    # MetaForge base
-    for item in metaforge_items:
-        key = item_key(item)
-        merged[key] = dict(item)
+    # MetaForge base – records share the input dicts until an overlay writes to them
+    merged: Dict[str, Dict[str, Any]] = {_key(item): item for item in metaforge_items}
+    # Keys whose record is already our own copy and safe to mutate
+    copied: Set[str] = set()
 
     # RaidTheory overlay / additions
     for item in raidtheory_items:
-        key = item_key(item)
+        key = _key(item)
         if key in merged:
             base = merged[key]
+            if key not in copied:
+                base = merged[key] = _dict(base)
+                copied.add(key)
             # Overlay non-empty values from RaidTheory
-            for k, v in item.items():
-                if v not in (None, "", [], {}):
-                    base[k] = v
+            if not any(v in EMPTY_VALUES for v in item.values()):
+                base.update(item)
+            else:
+                for k, v in item.items():
+                    if v not in EMPTY_VALUES:
+                        base[k] = v
         else:
-            merged[key] = dict(item)
+            # Copied lazily too, if a later RaidTheory entry overlays it
+            merged[key] = item
 
     items_list = list(merged.values())
     logging.info(
@@ -154,28 +276,56 @@ def merge_items(
 
     items_list.sort(key=sort_key)
 
-    normalized: List[Dict[str, Any]] = []
-    for item in items_list:
-        normalized.append({k: item[k] for k in sorted(item.keys())})
-
-    return normalized
+    # Keys inside each item are sorted by write_items (orjson OPT_SORT_KEYS)
+    return items_list
 
 
 # ---- Writer -----------------------------------------------------------------
 
+def output_unchanged(payload: bytes) -> bool:
+    """Check whether data/items.json already holds exactly `payload`."""
+    try:
+        # Cheap size check first; only read the file when the sizes match
+        if OUTPUT_PATH.stat().st_size != len(payload):
+            return False
+        return OUTPUT_PATH.read_bytes() == payload
+    except FileNotFoundError:
+        return False
+
+
 def write_items(items: List[Dict[str, Any]]) -> None:
     """Write merged items to data/items.json with pretty, stable JSON."""
+    payload = orjson.dumps(
+        items,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE,
+    )
+
+    if output_unchanged(payload):
+        logging.info("%s is unchanged – skipping write", OUTPUT_PATH)
+        return
+
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     logging.info("Writing %d items to %s", len(items), OUTPUT_PATH)
-    with OUTPUT_PATH.open("w", encoding="utf-8") as f:
-        json.dump(items, f, indent=2, ensure_ascii=False)
+
+    # Write to a temp file and swap it in, so readers never see a partial file
+    tmp_path = OUTPUT_PATH.with_suffix(".json.tmp")
+    try:
+        tmp_path.write_bytes(payload)
+        os.replace(tmp_path, OUTPUT_PATH)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
 
 
 # ---- Main -------------------------------------------------------------------
 
 def main() -> None:
-    metaforge_items = load_metaforge_items()
-    raidtheory_items = load_raidtheory_items()
+    # Overlap the MetaForge download with reading the local RaidTheory files
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        metaforge_future = executor.submit(load_metaforge_items)
+        raidtheory_future = executor.submit(load_raidtheory_items)
+        metaforge_items = metaforge_future.result()
+        raidtheory_items = raidtheory_future.result()
     merged_items = merge_items(metaforge_items, raidtheory_items)
     write_items(merged_items)
 